@@ -4,10 +4,15 @@ VERSIÓN CON CALIBRACIÓN EN TIEMPO REAL
 """
 import streamlit as st
 from pathlib import Path
+import os
+import tempfile
+import time
+import weakref
 import fitz  # PyMuPDF
-from pdf2image import convert_from_path
 from PIL import Image, ImageDraw, ImageFont
 from datetime import datetime, timedelta
+from exportar_rotulos import exportar_rotulos_zip
+from miniaturas import BLOQUEO_MUPDF, GeneradorMiniaturas, renderizar_pagina
 
 # Configuración de página
 st.set_page_config(
@@ -35,22 +40,31 @@ COORDENADAS_DEFAULT = {
 }
 
 
-def dividir_pdf_en_rotulos(pdf_path, columnas=2, filas=6, dpi=200):
-    """Divide el PDF en imágenes de rótulos individuales para preview"""
+def dividir_pdf_en_rotulos(pdf_path, columnas=2, filas=6):
+    """
+    Divide el PDF en rótulos individuales a partir del tamaño de cada página.
+    No rasteriza: cada caja se expresa como fracción de la página (0-1) y
+    las páginas se renderizan solo cuando se abren.
+    """
     try:
-        imagenes = convert_from_path(pdf_path, dpi=dpi)
+        with BLOQUEO_MUPDF:
+            doc = fitz.open(pdf_path)
+            tamanos = [(page.rect.width, page.rect.height) for page in doc]
+            doc.close()
     except Exception as e:
-        st.error(f"❌ Error al convertir PDF: {e}")
+        st.error(f"❌ Error al leer PDF: {e}")
         return None
 
     rotulos = []
 
-    for num_pagina, imagen in enumerate(imagenes, 1):
-        ancho_img, alto_img = imagen.size
-        margen_pie = int(alto_img * 0.05)
-        alto_util = alto_img - margen_pie
-        ancho_rotulo = ancho_img // columnas
-        alto_rotulo = alto_util // filas
+    alto_util = 0.95  # 5% de margen inferior (pie de página)
+    ancho_rotulo = 1 / columnas
+    alto_rotulo = alto_util / filas
+    margen_pt = 1.8  # 5 px a 200 DPI
+
+    for num_pagina, (ancho_pt, alto_pt) in enumerate(tamanos, 1):
+        margen_x = margen_pt / ancho_pt
+        margen_y = margen_pt / alto_pt
 
         for fila in range(filas):
             for col in range(columnas):
@@ -59,30 +73,142 @@ def dividir_pdf_en_rotulos(pdf_path, columnas=2, filas=6, dpi=200):
                 x2 = x1 + ancho_rotulo
                 y2 = y1 + alto_rotulo
 
-                margen = 5
-                try:
-                    rotulo_img = imagen.crop((
-                        max(0, x1 + margen),
-                        max(0, y1 + margen),
-                        min(ancho_img, x2 - margen),
-                        min(alto_util, y2 - margen)
-                    ))
-                except:
-                    continue
-
                 posicion = (fila * columnas) + col + 1
 
+                # Caja de recorte relativa a la página (0-1), independiente del DPI
+                caja = (
+                    max(0, x1 + margen_x),
+                    max(0, y1 + margen_y),
+                    min(1, x2 - margen_x),
+                    min(alto_util, y2 - margen_y)
+                )
+
                 rotulos.append({
                     'id': f"P{num_pagina}_R{posicion:02d}",
                     'pagina': num_pagina,
                     'posicion': posicion,
                     'fila': fila + 1,
                     'columna': col + 1,
-                    'imagen': rotulo_img,
+                    'caja': caja,
                     'hora': ''
                 })
 
-    return rotulos, imagenes
+    return rotulos, len(tamanos)
+
+
+@st.cache_resource
+def obtener_dir_sesiones():
+    """Directorio temporal de la app para las copias de PDF de las sesiones"""
+    # Único por servidor; TemporaryDirectory lo borra al terminar el proceso
+    return tempfile.TemporaryDirectory(prefix="rotulos_")
+
+
+class CopiaPDF:
+    """
+    Copia del PDF subido, propia de una sesión. Se borra al procesar otro
+    PDF o cuando Streamlit descarta la sesión (y con ella este objeto).
+    """
+
+    def __init__(self, datos):
+        fd, ruta = tempfile.mkstemp(suffix=".pdf", dir=obtener_dir_sesiones().name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        self.ruta = Path(ruta)
+        self._finalizador = weakref.finalize(self, self.ruta.unlink, True)
+
+    def borrar(self):
+        self._finalizador()
+
+
+def obtener_imagen_pagina(pdf_path, pagina, dpi=200):
+    """Renderiza una página a resolución completa solo al abrirla (cacheada en sesión)"""
+    cache = st.session_state.paginas_render
+    if pagina not in cache:
+        with BLOQUEO_MUPDF:
+            doc = fitz.open(pdf_path)
+            try:
+                cache[pagina] = renderizar_pagina(doc, pagina, dpi)
+            finally:
+                doc.close()
+    return cache[pagina]
+
+
+def mostrar_navegador_miniaturas(key_pagina, paginas, por_fila=8):
+    """
+    Tira de miniaturas para elegir página. Las miniaturas que aún no están
+    listas quedan como huecos; devuelve (huecos, estado) para que
+    completar_miniaturas() los llene al final de la ejecución.
+    """
+    generador = st.session_state.get('miniaturas')
+    if generador is None:
+        return None
+
+    def seleccionar(pagina):
+        st.session_state[key_pagina] = pagina
+
+    pagina_actual = st.session_state.get(key_pagina)
+    huecos = []
+
+    for inicio in range(0, len(paginas), por_fila):
+        cols = st.columns(por_fila)
+        for col, pagina in zip(cols, paginas[inicio:inicio + por_fila]):
+            with col:
+                hueco = st.empty()
+                miniatura = generador.obtener(pagina)
+                if miniatura is not None:
+                    hueco.image(miniatura, width="stretch")
+                else:
+                    hueco.caption("⏳")
+                    huecos.append((pagina, hueco))
+
+                marca = "🔹 " if pagina == pagina_actual else ""
+                st.button(f"{marca}{pagina}", key=f"{key_pagina}_mini_{pagina}",
+                          on_click=seleccionar, args=(pagina,))
+
+    estado = st.empty()
+    mostrar_estado_miniaturas(estado, generador)
+    return huecos, estado
+
+
+def mostrar_estado_miniaturas(estado, generador):
+    """Muestra el progreso (o el error) de la generación de miniaturas"""
+    if not generador.terminado:
+        estado.caption(f"🖼️ Generando miniaturas... {generador.listas}/{generador.num_paginas}")
+    elif generador.error:
+        estado.caption(f"⚠️ Miniaturas no disponibles: {generador.error}")
+    else:
+        estado.empty()
+
+
+def completar_miniaturas(navegadores, intervalo=0.25):
+    """
+    Llena los huecos de las tiras a medida que el hilo de fondo termina cada
+    página. Se llama al final de main(): cada miniatura se envía una sola vez
+    y cualquier interacción del usuario interrumpe la espera con un rerun.
+    """
+    generador = st.session_state.get('miniaturas')
+    navegadores = [n for n in navegadores if n]
+    if generador is None or not navegadores:
+        return
+
+    while any(huecos for huecos, _ in navegadores):
+        # Leer antes de revisar los huecos para no perder la última página
+        terminado = generador.terminado
+
+        for huecos, estado in navegadores:
+            pendientes = []
+            for pagina, hueco in huecos:
+                miniatura = generador.obtener(pagina)
+                if miniatura is not None:
+                    hueco.image(miniatura, width="stretch")
+                else:
+                    pendientes.append((pagina, hueco))
+            huecos[:] = pendientes
+            mostrar_estado_miniaturas(estado, generador)
+
+        if terminado:
+            break
+        time.sleep(intervalo)
 
 
 def obtener_coordenadas(rotulo, calibraciones):
@@ -331,10 +457,16 @@ def main():
     # Session state
     if 'rotulos' not in st.session_state:
         st.session_state.rotulos = None
-    if 'imagenes' not in st.session_state:
-        st.session_state.imagenes = None
+    if 'num_paginas' not in st.session_state:
+        st.session_state.num_paginas = 0
+    if 'paginas_render' not in st.session_state:
+        st.session_state.paginas_render = {}
+    if 'miniaturas' not in st.session_state:
+        st.session_state.miniaturas = None
     if 'pdf_path' not in st.session_state:
         st.session_state.pdf_path = None
+    if 'pdf_copia' not in st.session_state:
+        st.session_state.pdf_copia = None
     if 'calibraciones' not in st.session_state:
         st.session_state.calibraciones = {}
     if 'cal_posicion' not in st.session_state:
@@ -349,17 +481,29 @@ def main():
         uploaded_file = st.file_uploader("Selecciona PDF", type=['pdf'])
         
         if uploaded_file:
-            temp_path = Path("temp_uploaded.pdf")
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
             if st.button("🔄 Procesar PDF", type="primary"):
                 with st.spinner("Procesando..."):
-                    resultado = dividir_pdf_en_rotulos(temp_path)
-                    if resultado:
-                        st.session_state.rotulos, st.session_state.imagenes = resultado
-                        st.session_state.pdf_path = temp_path
+                    # Copia propia de la sesión: las páginas se renderizan más tarde
+                    # y deben salir del mismo PDF con el que se calcularon los rótulos
+                    copia = CopiaPDF(uploaded_file.getbuffer())
+
+                    resultado = dividir_pdf_en_rotulos(copia.ruta)
+                    if not resultado:
+                        copia.borrar()
+                    else:
+                        if st.session_state.pdf_copia:
+                            st.session_state.pdf_copia.borrar()
+                        st.session_state.rotulos, st.session_state.num_paginas = resultado
+                        st.session_state.pdf_copia = copia
+                        st.session_state.pdf_path = copia.ruta
                         st.session_state.calibraciones = {}
+                        st.session_state.paginas_render = {}
+                        if st.session_state.miniaturas:
+                            st.session_state.miniaturas.detener()
+                        st.session_state.miniaturas = GeneradorMiniaturas(
+                            uploaded_file.getvalue(),
+                            st.session_state.num_paginas
+                        ).iniciar()
                         st.success(f"✅ {len(st.session_state.rotulos)} rótulos")
                         st.rerun()
         
@@ -368,7 +512,7 @@ def main():
             st.header("📋 3. Configurar Rótulos")
             
             # Calcular número de páginas
-            num_paginas = len(st.session_state.imagenes)
+            num_paginas = st.session_state.num_paginas
             
             # Campo para rótulos en última página
             rotulos_ultima = st.number_input(
@@ -409,7 +553,7 @@ def main():
                     
                     # Obtener número de rótulos en última página
                     rotulos_ultima = st.session_state.get('rotulos_ultima_pagina', 12)
-                    num_paginas = len(st.session_state.imagenes)
+                    num_paginas = st.session_state.num_paginas
                     
                     # Filtrar solo rótulos válidos
                     rotulos_validos = []
@@ -441,7 +585,7 @@ def main():
             total = len(st.session_state.rotulos)
             con_hora = sum(1 for r in st.session_state.rotulos if r.get('hora'))
             rotulos_ultima = st.session_state.get('rotulos_ultima_pagina', 12)
-            num_paginas = len(st.session_state.imagenes)
+            num_paginas = st.session_state.num_paginas
             if num_paginas == 1:
                 total_validos = rotulos_ultima
             else:
@@ -453,6 +597,9 @@ def main():
         st.info("👆 Sube un PDF desde el panel lateral")
         return
 
+    # Tiras de miniaturas con huecos por llenar (ver completar_miniaturas)
+    navegadores = []
+
     # Botón de configuración en la parte superior
     col_title, col_config = st.columns([4, 1])
     
@@ -468,6 +615,9 @@ def main():
             if not any(r.get('hora') for r in st.session_state.rotulos):
                 st.warning("⚠️ Primero aplica horas desde el panel lateral (sidebar)")
             else:
+                paginas = sorted(set(r['pagina'] for r in st.session_state.rotulos))
+                navegadores.append(mostrar_navegador_miniaturas("cal_pag_select", paginas))
+
                 # Dividir en dos columnas: controles y preview
                 col_controles, col_preview = st.columns([1, 2])
                 
@@ -475,7 +625,6 @@ def main():
                     st.markdown("### 🎛️ Controles")
                     
                     # Seleccionar página
-                    paginas = sorted(set(r['pagina'] for r in st.session_state.rotulos))
                     pagina_sel = st.selectbox(
                         "📄 Página", 
                         paginas, 
@@ -590,7 +739,7 @@ def main():
                     st.markdown("### 👁️ Vista Previa en Tiempo Real")
                     
                     rotulos_pag = [r for r in st.session_state.rotulos if r['pagina'] == pagina_sel]
-                    img = st.session_state.imagenes[pagina_sel - 1]
+                    img = obtener_imagen_pagina(st.session_state.pdf_path, pagina_sel)
                     
                     preview = dibujar_preview_calibracion(
                         img, 
@@ -608,7 +757,7 @@ def main():
         st.divider()
 
     # --- TABS PRINCIPALES (Preview y Generar) ---
-    tab1, tab2 = st.tabs(["👁️ Preview", "📄 Generar PDF"])
+    tab1, tab2, tab3 = st.tabs(["👁️ Preview", "📄 Generar PDF", "🖼️ Exportar Rótulos"])
 
     # --- TAB PREVIEW ---
     with tab1:
@@ -617,9 +766,11 @@ def main():
         if not any(r.get('hora') for r in st.session_state.rotulos):
             st.warning("⚠️ Primero aplica horas (sidebar)")
         else:
+            paginas = sorted(set(r['pagina'] for r in st.session_state.rotulos))
+            navegadores.append(mostrar_navegador_miniaturas("preview_page", paginas))
+
             col_sel, col_btn = st.columns([3, 1])
             with col_sel:
-                paginas = sorted(set(r['pagina'] for r in st.session_state.rotulos))
                 pag = st.selectbox("Página", paginas, format_func=lambda x: f"Página {x}", key="preview_page")
             
             with col_btn:
@@ -628,7 +779,7 @@ def main():
             
             # Generar preview automáticamente o al presionar botón
             rotulos_pag = [r for r in st.session_state.rotulos if r['pagina'] == pag]
-            img = st.session_state.imagenes[pag - 1]
+            img = obtener_imagen_pagina(st.session_state.pdf_path, pag)
             preview = dibujar_preview_pagina(img, rotulos_pag, st.session_state.calibraciones)
             st.image(preview, use_column_width=True, caption="Horas en ROJO (posiciones finales)")
 
@@ -656,12 +807,14 @@ def main():
                     pdf_out = Path("output") / f"PDF_con_horas_{timestamp}.pdf"
                     pdf_out.parent.mkdir(exist_ok=True)
                     
-                    if agregar_horas_a_pdf(
-                        st.session_state.pdf_path,
-                        st.session_state.rotulos,
-                        pdf_out,
-                        st.session_state.calibraciones
-                    ):
+                    with BLOQUEO_MUPDF:
+                        generado = agregar_horas_a_pdf(
+                            st.session_state.pdf_path,
+                            st.session_state.rotulos,
+                            pdf_out,
+                            st.session_state.calibraciones
+                        )
+                    if generado:
                         if pdf_out.exists():
                             st.success("✅ PDF generado correctamente!")
                             
@@ -678,6 +831,80 @@ def main():
                     else:
                         st.error("❌ Error al generar PDF")
 
+    # --- TAB EXPORTAR RÓTULOS ---
+    with tab3:
+        st.header("🖼️ Exportar Rótulos como Imágenes")
+        st.caption("Cada rótulo se exporta como PNG (P{página}_R{posición}.png) dentro de un ZIP")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            dpi_export = st.number_input("DPI", min_value=72, max_value=600, value=300, step=50)
+        with col2:
+            hay_horas = any(r.get('hora') for r in st.session_state.rotulos)
+            incluir_horas = st.checkbox(
+                "Incluir horas",
+                value=hay_horas,
+                disabled=not hay_horas,
+                help="Renderiza los rótulos con las horas estampadas"
+            )
+
+        if st.button("🖼️ EXPORTAR ZIP", type="primary"):
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            zip_out = Path("output") / f"rotulos_{timestamp}.zip"
+            zip_out.parent.mkdir(exist_ok=True)
+
+            # Solo rótulos válidos (la última página puede tener menos de 12)
+            rotulos_ultima = st.session_state.get('rotulos_ultima_pagina', 12)
+            num_paginas = st.session_state.num_paginas
+            rotulos_export = [
+                r for r in st.session_state.rotulos
+                if r['pagina'] != num_paginas or r['posicion'] <= rotulos_ultima
+            ]
+
+            exportados = None
+            # El PDF con horas es solo un intermedio: no debe quedar en output/
+            with tempfile.TemporaryDirectory() as dir_temp:
+                pdf_origen = st.session_state.pdf_path
+                if incluir_horas:
+                    pdf_origen = Path(dir_temp) / "rotulos_con_horas.pdf"
+                    with BLOQUEO_MUPDF:
+                        estampado = agregar_horas_a_pdf(
+                            st.session_state.pdf_path,
+                            st.session_state.rotulos,
+                            pdf_origen,
+                            st.session_state.calibraciones
+                        )
+                    if not estampado:
+                        pdf_origen = None
+                        st.error("❌ Error al estampar horas")
+
+                if pdf_origen:
+                    barra = st.progress(0.0)
+                    try:
+                        exportados = exportar_rotulos_zip(
+                            pdf_origen,
+                            rotulos_export,
+                            zip_out,
+                            dpi=dpi_export,
+                            progreso=lambda hechas, total: barra.progress(hechas / total)
+                        )
+                    except Exception as e:
+                        st.error(f"❌ Error al exportar: {e}")
+
+            if exportados is not None:
+                st.success(f"✅ {exportados} rótulos exportados")
+
+                with open(zip_out, "rb") as f:
+                    st.download_button(
+                        "⬇️ DESCARGAR ZIP",
+                        f,
+                        f"rotulos_{timestamp}.zip",
+                        "application/zip",
+                        type="primary"
+                    )
+
+    # Al final: esperar miniaturas pendientes sin bloquear el resto de la página
+    completar_miniaturas(navegadores)
 
 if __name__ == "__main__":
     Path("output").mkdir(exist_ok=True)
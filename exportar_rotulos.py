@@ -0,0 +1,121 @@
+"""
+Exportación de rótulos individuales como imágenes PNG dentro de un ZIP.
+
+Módulo separado de app.py (sin Streamlit) para que las funciones puedan
+ejecutarse en un pool de procesos.
+"""
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+
+# Pools reutilizados entre exportaciones, por número de workers
+_EJECUTORES = {}
+_EJECUTORES_LOCK = threading.Lock()
+
+
+def _obtener_ejecutor(workers):
+    """
+    Devuelve un pool de procesos vivo, creándolo la primera vez. Siempre
+    procesos: MuPDF no es seguro entre hilos. Se usa "spawn" porque el
+    servidor de Streamlit tiene varios hilos y un fork podría heredar locks
+    tomados (incluidos los globales de MuPDF).
+    """
+    with _EJECUTORES_LOCK:
+        if workers not in _EJECUTORES:
+            _EJECUTORES[workers] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _EJECUTORES[workers]
+
+
+def renderizar_rotulos_pagina(pdf_path, num_pagina, cajas, dpi):
+    """
+    Renderiza los rótulos de una página directamente desde el PDF.
+    `cajas` es una lista de (id, (x1, y1, x2, y2)) en coordenadas relativas.
+    Devuelve una lista de (id, bytes PNG).
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc[num_pagina - 1]
+        pw = page.rect.width
+        ph = page.rect.height
+
+        resultado = []
+        for rotulo_id, (x1, y1, x2, y2) in cajas:
+            clip = fitz.Rect(pw * x1, ph * y1, pw * x2, ph * y2)
+            pix = page.get_pixmap(dpi=dpi, clip=clip)
+            resultado.append((rotulo_id, pix.tobytes("png")))
+        return resultado
+    finally:
+        doc.close()
+
+
+def exportar_rotulos_zip(pdf_path, rotulos, zip_salida, dpi=300, max_workers=None,
+                         progreso=None):
+    """
+    Exporta cada rótulo como PNG (P{pagina}_R{pos}.png) dentro de un ZIP.
+
+    El renderizado se reparte por páginas en un pool de procesos, reutilizado
+    entre llamadas, y los resultados se escriben al ZIP en orden de página a
+    medida que llegan, con un máximo de tareas en vuelo para no acumular
+    todas las imágenes en memoria. `progreso(hechas, total)` se llama tras
+    escribir cada página.
+    Devuelve el número de imágenes escritas.
+    """
+    por_pagina = {}
+    for rotulo in rotulos:
+        por_pagina.setdefault(rotulo['pagina'], []).append((rotulo['id'], rotulo['caja']))
+
+    workers = max_workers or os.cpu_count() or 1
+    max_en_vuelo = workers * 2
+    ejecutor = _obtener_ejecutor(workers)
+
+    total_paginas = len(por_pagina)
+    paginas_hechas = 0
+    escritas = 0
+
+    def escribir(zf, futuro):
+        nonlocal paginas_hechas, escritas
+        for rotulo_id, png in futuro.result():
+            # PNG ya está comprimido: ZIP_STORED evita recomprimir
+            zf.writestr(f"{rotulo_id}.png", png)
+            escritas += 1
+        paginas_hechas += 1
+        if progreso:
+            progreso(paginas_hechas, total_paginas)
+
+    # Se escribe con otro nombre y se mueve al final: un fallo a mitad no debe
+    # dejar un ZIP truncado con apariencia válida junto a las exportaciones buenas
+    zip_parcial = f"{zip_salida}.parcial"
+    pendientes = deque()
+    try:
+        with zipfile.ZipFile(zip_parcial, "w", zipfile.ZIP_STORED) as zf:
+            for num_pagina, cajas in sorted(por_pagina.items()):
+                pendientes.append(
+                    ejecutor.submit(renderizar_rotulos_pagina, str(pdf_path), num_pagina, cajas, dpi)
+                )
+                if len(pendientes) >= max_en_vuelo:
+                    escribir(zf, pendientes.popleft())
+
+            while pendientes:
+                escribir(zf, pendientes.popleft())
+        os.replace(zip_parcial, zip_salida)
+    except BrokenProcessPool:
+        # Un proceso murió: descartar el pool para que la próxima exportación cree otro
+        with _EJECUTORES_LOCK:
+            _EJECUTORES.pop(workers, None)
+        raise
+    finally:
+        for futuro in pendientes:
+            futuro.cancel()
+        if os.path.exists(zip_parcial):
+            os.remove(zip_parcial)
+
+    return escritas
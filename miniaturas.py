@@ -0,0 +1,80 @@
+"""
+Miniaturas de páginas a bajo DPI renderizadas en segundo plano.
+
+Módulo sin Streamlit: el hilo de fondo no debe tocar la interfaz, solo
+llena una caché que la app consulta en cada ejecución.
+"""
+import threading
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+# MuPDF no es seguro entre hilos: todo uso de fitz fuera del pool de
+# exportación (que corre en procesos) debe hacerse con este bloqueo
+BLOQUEO_MUPDF = threading.Lock()
+
+
+def renderizar_pagina(doc, pagina, dpi):
+    """Renderiza una página (1-indexada) de un documento abierto como imagen PIL"""
+    pix = doc[pagina - 1].get_pixmap(dpi=dpi)
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+class GeneradorMiniaturas:
+    """Renderiza las miniaturas página por página, en orden, y las cachea"""
+
+    def __init__(self, pdf_bytes, num_paginas, dpi=20):
+        self.num_paginas = num_paginas
+        self.dpi = dpi
+        self.error = None
+        self._pdf_bytes = pdf_bytes
+        self._miniaturas = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._renderizar, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+
+    def obtener(self, pagina):
+        """Devuelve la miniatura de la página o None si aún no está lista"""
+        with self._lock:
+            return self._miniaturas.get(pagina)
+
+    @property
+    def listas(self):
+        with self._lock:
+            return len(self._miniaturas)
+
+    @property
+    def terminado(self):
+        return not self._hilo.is_alive()
+
+    def _renderizar(self):
+        # Documento propio en memoria, independiente de los archivos de la app
+        try:
+            with BLOQUEO_MUPDF:
+                doc = fitz.open(stream=self._pdf_bytes, filetype="pdf")
+        except Exception as e:
+            self.error = e
+            return
+        self._pdf_bytes = None
+
+        try:
+            for pagina in range(1, self.num_paginas + 1):
+                if self._detener.is_set():
+                    return
+                # Bloqueo por página para no frenar a la app más de un render
+                with BLOQUEO_MUPDF:
+                    miniatura = renderizar_pagina(doc, pagina, self.dpi)
+                with self._lock:
+                    self._miniaturas[pagina] = miniatura
+        except Exception as e:
+            self.error = e
+        finally:
+            with BLOQUEO_MUPDF:
+                doc.close()